@@ -1,17 +1,15 @@
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import importlib
+import multiprocessing
+import os
 import logging
 import yaml
-from modules import (
-    video_downloader,
-    video_processor,
-    pose_estimation,
-    bat_detection,
-    metrics,
-    overlay,
-    evaluation,
-    phase_segmentation,
-    contact_detection
-)
+
+# Pipeline modules are imported lazily inside each step, and pose/bat detection defer
+# their heavy dependencies (mediapipe, torch/ultralytics, av) until after their cache
+# check, so a fully cached re-run doesn't pay for them.
 
 # ------------------ Setup Logger ------------------
 logger = logging.getLogger(__name__)
@@ -33,6 +31,12 @@ TARGET_RES = tuple(config.get("resolution", [1280, 720]))
 OUTPUT_DIR = Path(config.get("output_dir", "output/"))
 LOGS_DIR = Path(config.get("logs_dir", "logs/"))
 MODELS_DIR = Path(config.get("models_dir", "models/"))
+BAT_BATCH_SIZE = config.get("bat_batch_size", 8)
+POSE_SAMPLE_STRIDE = config.get("pose_sample_stride", 1)
+POSE_COMPLEXITY = config.get("pose_complexity", 0)
+POSE_INPUT_SIDE = config.get("pose_input_side")
+OVERLAY_CONTACT_WINDOW = config.get("overlay_contact_window")
+OVERLAY_WORKERS = config.get("overlay_workers") or os.cpu_count()
 
 # Ensure directories exist
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -42,6 +46,11 @@ INPUT_DIR = Path("input")
 INPUT_DIR.mkdir(exist_ok=True)
 
 # ------------------ Main Pipeline -----------------
+def _run_step(module_name: str, *args, **kwargs):
+    """Import `modules.<module_name>` and call its run() — used so worker processes do the heavy import."""
+    return importlib.import_module(f"modules.{module_name}").run(*args, **kwargs)
+
+
 def main():
     logger.info("Starting AthleteRise Cover Drive Analysis Pipeline...")
 
@@ -50,6 +59,7 @@ def main():
     try:
         if not input_video_path.exists():
             logger.info("Downloading video (video-only)...")
+            from modules import video_downloader
             video_downloader.run(
                 url=VIDEO_URL,
                 output_path=input_video_path  # Path object
@@ -62,6 +72,7 @@ def main():
 
     # STEP 2: Normalize video
     try:
+        from modules import video_processor
         norm_video_path = Path(
             video_processor.run(
                 input_video_path,
@@ -75,27 +86,51 @@ def main():
         logger.error(f"Video normalization failed: {e}")
         return
 
-    # STEP 3: Pose estimation
-    try:
-        keypoints_file = Path(pose_estimation.run(norm_video_path))
-        if not keypoints_file.exists():
-            raise FileNotFoundError(f"Pose keypoints file not found at {keypoints_file}")
-    except Exception as e:
-        logger.error(f"Pose estimation failed: {e}")
-        return
-
-    # STEP 4: Bat detection
-    try:
-        bat_file = Path(bat_detection.run(norm_video_path))
-        if not bat_file.exists():
-            raise FileNotFoundError(f"Bat positions file not found at {bat_file}")
-    except Exception as e:
-        logger.error(f"Bat detection failed: {e}")
-        return
+    # STEP 3 + 4: Pose estimation (CPU) and bat detection (GPU) run concurrently.
+    # Both modules import their heavy dependencies only inside run(), so the cache checks here are
+    # cheap; steps that are already up-to-date are served in-process and never spawn a worker.
+    from modules import pose_estimation, bat_detection
+    pose_kwargs = {"sample_stride": POSE_SAMPLE_STRIDE, "model_complexity": POSE_COMPLEXITY,
+                   "input_side": POSE_INPUT_SIDE}
+    bat_kwargs = {"batch_size": BAT_BATCH_SIZE}
+    pending = []
+    if not pose_estimation.up_to_date(norm_video_path, **pose_kwargs):
+        pending.append(("pose_estimation", pose_kwargs))
+    if not bat_detection.up_to_date(norm_video_path, **bat_kwargs):
+        pending.append(("bat_detection", bat_kwargs))
+
+    # "spawn" keeps CUDA state out of forked children
+    pool = (ProcessPoolExecutor(max_workers=len(pending), mp_context=multiprocessing.get_context("spawn"))
+            if pending else nullcontext())
+    with pool as ex:
+        futures = {name: ex.submit(_run_step, name, norm_video_path, **kw) for name, kw in pending}
+
+        try:
+            f_kp = futures.get("pose_estimation")
+            keypoints_file = Path(f_kp.result() if f_kp else pose_estimation.run(norm_video_path, **pose_kwargs))
+            if not keypoints_file.exists():
+                raise FileNotFoundError(f"Pose keypoints file not found at {keypoints_file}")
+        except Exception as e:
+            # A running bat-detection job can't be cancelled; leaving the block waits for it
+            logger.error(f"Pose estimation failed: {e}")
+            return
+
+        try:
+            f_bat = futures.get("bat_detection")
+            bat_file = Path(f_bat.result() if f_bat else bat_detection.run(norm_video_path, **bat_kwargs))
+            if not bat_file.exists():
+                raise FileNotFoundError(f"Bat positions file not found at {bat_file}")
+        except Exception as e:
+            logger.error(f"Bat detection failed: {e}")
+            return
+
+    # DataFrames loaded by one step and reused by later ones instead of re-reading from disk
+    state = {}
 
     # STEP 5: Metrics computation
     try:
-        metrics_file = Path(metrics.run(keypoints_file, bat_file))
+        from modules import metrics
+        metrics_file = Path(metrics.run(keypoints_file, bat_file, state=state))
         if not metrics_file.exists():
             raise FileNotFoundError(f"Metrics file not found at {metrics_file}")
     except Exception as e:
@@ -104,7 +139,8 @@ def main():
 
     # STEP 6: Phase segmentation
     try:
-        phases_file = Path(phase_segmentation.run(keypoints_file))
+        from modules import phase_segmentation
+        phases_file = Path(phase_segmentation.run(keypoints_file, state=state))
         if not phases_file.exists():
             logger.warning("Phase segmentation file not found, continuing without it")
             phases_file = None
@@ -114,6 +150,7 @@ def main():
 
     # STEP 7: Contact detection
     try:
+        from modules import contact_detection
         contact_file = Path(contact_detection.run(
             keypoints_file,
             bat_file,
@@ -128,13 +165,17 @@ def main():
 
     # STEP 8: Overlay
     try:
+        from modules import overlay
         annotated_video = Path(overlay.run(
             norm_video_path,
             keypoints_file,
             bat_file,
             metrics_file,
             phases_csv=phases_file,
-            contact_file=contact_file
+            contact_file=contact_file,
+            contact_window=OVERLAY_CONTACT_WINDOW,
+            state=state,
+            workers=OVERLAY_WORKERS
         ))
 
         if not annotated_video.exists():
@@ -146,6 +187,7 @@ def main():
 
     # STEP 9: Final evaluation
     try:
+        from modules import evaluation
         eval_file = Path(evaluation.run(metrics_file, phases_file, contact_file))
         if not eval_file.exists():
             logger.warning("Evaluation JSON not found")
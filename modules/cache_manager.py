@@ -1,55 +1,133 @@
+import os
 import json
 import hashlib
+import functools
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
 from typing import List, Dict, Any
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 CACHE_FILE = Path("logs/cache.json")
+LOCK_FILE = Path("logs/cache.json.lock")
+HASH_CHUNK_SIZE = 1 << 22  # 4 MiB
+
+# In-process copy of CACHE_FILE, loaded once per run
+_CACHE = None
+
+def _load() -> Dict[str, Any]:
+    """Return the cache dict, reading CACHE_FILE only on first use."""
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = json.loads(CACHE_FILE.read_text()) if CACHE_FILE.exists() else {}
+    return _CACHE
+
+@contextmanager
+def _locked():
+    """Hold an exclusive inter-process lock on LOCK_FILE (pose/bat workers write concurrently)."""
+    LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_FILE, "a+b") as lf:
+        if fcntl:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+        else:
+            lf.seek(0)
+            msvcrt.locking(lf.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+            else:
+                lf.seek(0)
+                msvcrt.locking(lf.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _store(step_name: str, record: Dict[str, Any]):
+    """Write one step's record through to disk and the in-process copy."""
+    global _CACHE
+    with _locked():
+        # Merge with the file on disk so records written by other processes survive
+        cache = json.loads(CACHE_FILE.read_text()) if CACHE_FILE.exists() else {}
+        cache[step_name] = record
+        # Write a temp file and rename it over CACHE_FILE so readers never see a partial file
+        with tempfile.NamedTemporaryFile("w", dir=CACHE_FILE.parent, suffix=".tmp", delete=False) as tmp:
+            tmp.write(json.dumps(cache, indent=2))
+        # NamedTemporaryFile is created 0600; keep the existing file's mode across the rename
+        os.chmod(tmp.name, CACHE_FILE.stat().st_mode & 0o777 if CACHE_FILE.exists() else 0o644)
+        os.replace(tmp.name, CACHE_FILE)
+    _CACHE = cache
+
+@functools.lru_cache(maxsize=4096)
+def _digest(path_str: str, mtime_ns: int, size: int) -> str:
+    """Content digest of one file; memoised on (path, mtime, size) so sibling steps share it."""
+    h = hashlib.blake2b(digest_size=16)
+    # Stream in chunks so memory stays flat for multi-GB videos
+    with open(path_str, "rb", buffering=0) as file:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 def _hash_files(files: List[Path]) -> str:
-    """Return a combined hash of file contents and modified times."""
+    """Return a combined hash of file contents."""
     hash_md5 = hashlib.md5()
     for f in files:
-        if f.exists():
-            hash_md5.update(str(f.stat().st_mtime).encode())
-            with open(f, "rb") as file:
-                hash_md5.update(file.read())
+        if f and f.exists():
+            st = f.stat()
+            hash_md5.update(_digest(str(Path(f).resolve()), st.st_mtime_ns, st.st_size).encode())
     return hash_md5.hexdigest()
 
+def _stat_files(files: List[Path]) -> str:
+    """Return a cheap fingerprint of (path, size, mtime_ns) without opening the files."""
+    stats = []
+    for f in files:
+        if f and f.exists():
+            st = f.stat()
+            stats.append([str(f), st.st_size, st.st_mtime_ns])
+    return hashlib.md5(json.dumps(stats).encode()).hexdigest()
+
+def _hash_config(config: Dict[str, Any]) -> str:
+    return hashlib.md5(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
 def needs_update(step_name: str, files: List[Path], config: Dict[str, Any]) -> bool:
     """
     Check if the step needs to be re-run based on:
       - Missing output files
       - Changed input files
       - Changed config
+    `files` must be the same list the step passes to update_cache (inputs and outputs),
+    otherwise the recorded hashes never match. Missing files (or None) are skipped.
+    Files whose path, size and mtime are unchanged are not re-hashed.
     """
-    if not CACHE_FILE.exists():
+    prev = _load().get(step_name)
+    if not prev:
         return True
 
-    cache = json.loads(CACHE_FILE.read_text())
+    if prev["config_hash"] != _hash_config(config):
+        return True
 
-    file_hash = _hash_files(files)
-    config_hash = hashlib.md5(json.dumps(config, sort_keys=True).encode()).hexdigest()
+    # Fast path: identical file metadata means identical inputs
+    stat_hash = _stat_files(files)
+    if prev.get("stat_hash") == stat_hash:
+        return False
 
-    prev = cache.get(step_name)
-    if not prev:
+    # Metadata changed (e.g. touched/copied) — fall back to content comparison
+    if prev["file_hash"] != _hash_files(files):
         return True
 
-    return prev["file_hash"] != file_hash or prev["config_hash"] != config_hash
+    # Contents unchanged: remember the new metadata so the next check is cheap again
+    _store(step_name, {**prev, "stat_hash": stat_hash})
+    return False
 
 def update_cache(step_name: str, files: List[Path], config: Dict[str, Any]):
     """Update cache record for this step."""
-    cache = {}
-    if CACHE_FILE.exists():
-        cache = json.loads(CACHE_FILE.read_text())
-
-    file_hash = _hash_files(files)
-    config_hash = hashlib.md5(json.dumps(config, sort_keys=True).encode()).hexdigest()
-
-    cache[step_name] = {
-        "file_hash": file_hash,
-        "config_hash": config_hash
-    }
-
-    CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    CACHE_FILE.write_text(json.dumps(cache, indent=2))
-
+    _store(step_name, {
+        "file_hash": _hash_files(files),
+        "stat_hash": _stat_files(files),
+        "config_hash": _hash_config(config)
+    })
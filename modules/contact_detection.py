@@ -3,28 +3,29 @@ import pandas as pd
 import numpy as np
 from modules.logger import get_logger
 from modules.cache_manager import needs_update, update_cache
+from modules.table_io import OUTPUT_FORMAT, read_table
 
 logger = get_logger("contact_detection")
 
-IN_KPTS = Path("output/pose_keypoints.csv")
-IN_BATS = Path("output/bat_positions.csv")
-IN_PHASES = Path("output/phases.csv")
+IN_KPTS = Path(f"output/pose_keypoints.{OUTPUT_FORMAT}")
+IN_BATS = Path(f"output/bat_positions.{OUTPUT_FORMAT}")
+IN_PHASES = Path(f"output/phases.{OUTPUT_FORMAT}")
 OUT_CONTACT = Path("output/contact.json")
 
-def _vel(df: pd.DataFrame, k: int) -> np.ndarray:
-    x = df[f"x_{k}"].values
-    y = df[f"y_{k}"].values
-    sh_w = np.maximum(1e-6, np.sqrt((df["x_11"]-df["x_12"])**2 + (df["y_11"]-df["y_12"])**2).values)
-    vx = np.gradient(x)
-    vy = np.gradient(y)
-    return np.nan_to_num(np.sqrt(vx**2 + vy**2) / sh_w)
+POSE_COLS = ["frame", "x_11", "y_11", "x_12", "y_12", "x_15", "y_15", "x_16", "y_16"]
+
+def _vel(df: pd.DataFrame, k: int, sh_w: np.ndarray) -> np.ndarray:
+    """Speed of keypoint k per frame, normalized by shoulder width `sh_w` (NaN -> 0)."""
+    vx = np.gradient(df[f"x_{k}"].to_numpy(dtype=np.float64))
+    vy = np.gradient(df[f"y_{k}"].to_numpy(dtype=np.float64))
+    return np.nan_to_num(np.hypot(vx, vy) / sh_w)
 
 def run(pose_csv: Path = IN_KPTS, bat_csv: Path = IN_BATS, phases_csv: Path = IN_PHASES) -> Path:
     """Pick likely contact frame via combined wrist speed peak + bat-box speed peak near Downswing/Impact."""
     pose_csv, bat_csv, phases_csv = Path(pose_csv), Path(bat_csv), Path(phases_csv)
     step_config = {"pose": str(pose_csv), "bat": str(bat_csv), "phases": str(phases_csv)}
 
-    if OUT_CONTACT.exists() and not needs_update("contact_detection", [pose_csv, bat_csv, phases_csv], step_config):
+    if OUT_CONTACT.exists() and not needs_update("contact_detection", [pose_csv, bat_csv, phases_csv, OUT_CONTACT], step_config):
         logger.info("Contact already computed — skipping.")
         return OUT_CONTACT
 
@@ -33,38 +34,47 @@ def run(pose_csv: Path = IN_KPTS, bat_csv: Path = IN_BATS, phases_csv: Path = IN
     if not phases_csv.exists():
         raise FileNotFoundError(f"Phases file missing: {phases_csv}")
 
-    kdf = pd.read_csv(pose_csv)
-    wrist_v = np.maximum(_vel(kdf, 16), _vel(kdf, 15))  # right/left wrist
+    # Whole clip is loaded (only the 9 needed columns): min/ptp normalization must span every frame,
+    # not just the search window, or the wrist/bat weighting changes
+    kdf = read_table(pose_csv, columns=POSE_COLS)
+    lo, hi = int(kdf["frame"].min()), int(kdf["frame"].max())
+
+    # Limit search window around downswing/impact phases if present
+    pdf = read_table(phases_csv)
+    hit = pdf[pdf["phase"].isin(["Downswing", "Impact"])]
+    if hit.empty:
+        s, e = 0, hi
+    else:
+        s, e = int(hit.iloc[0]["start"]), int(hit.iloc[0]["end"])
+
+    # Shoulder width is shared by both wrists, so compute it once
+    sh_w = np.maximum(1e-6, np.hypot(kdf["x_11"].to_numpy(dtype=np.float64) - kdf["x_12"].to_numpy(dtype=np.float64),
+                                     kdf["y_11"].to_numpy(dtype=np.float64) - kdf["y_12"].to_numpy(dtype=np.float64)))
+    wrist_v = np.maximum(_vel(kdf, 16, sh_w), _vel(kdf, 15, sh_w))  # right/left wrist
 
     # Bat speed proxy (bbox center speed)
-    bdf = pd.read_csv(bat_csv) if bat_csv.exists() else pd.DataFrame(columns=["frame","x1","y1","x2","y2","confidence"])
-    max_frame = int(kdf["frame"].max())
-    cx = np.zeros(max_frame+1)
-    cy = np.zeros(max_frame+1)
+    if bat_csv.exists():
+        bdf = read_table(bat_csv, filters=[("frame", ">=", lo), ("frame", "<=", hi)])
+    else:
+        bdf = pd.DataFrame(columns=["frame","x1","y1","x2","y2","confidence"])
+    cx = np.zeros(hi-lo+1)
+    cy = np.zeros(hi-lo+1)
     if not bdf.empty:
         btop = (bdf.sort_values(["frame","confidence"], ascending=[True, False])
                    .drop_duplicates(subset=["frame"]))
-        for _, r in btop.iterrows():
-            f = int(r["frame"])
-            cx[f] = (r["x1"] + r["x2"]) / 2.0
-            cy[f] = (r["y1"] + r["y2"]) / 2.0
+        frames = btop["frame"].to_numpy(dtype=np.int64) - lo
+        cx[frames] = (btop["x1"] + btop["x2"]).to_numpy() * 0.5
+        cy[frames] = (btop["y1"] + btop["y2"]).to_numpy() * 0.5
     cb = np.sqrt(np.gradient(cx)**2 + np.gradient(cy)**2)
 
-    # normalize both using np.ptp()
-    wrist_z = (wrist_v - wrist_v.min()) / (np.ptp(wrist_v) + 1e-6)
-    bat_z   = (cb - cb.min()) / (np.ptp(cb) + 1e-6)
-    score_curve = 0.6 * wrist_z + 0.4 * bat_z
+    # normalize both using np.ptp() and blend 0.6/0.4, reusing two buffers in place
+    score_curve = np.subtract(wrist_v, wrist_v.min())
+    score_curve *= 0.6 / (np.ptp(wrist_v) + 1e-6)
+    bat_z = np.subtract(cb, cb.min(), out=cb)
+    bat_z *= 0.4 / (np.ptp(bat_z) + 1e-6)
+    score_curve += bat_z
 
-    # Limit search window around downswing/impact phases if present
-    pdf = pd.read_csv(phases_csv)
-    window = (0, max_frame)
-    for _, r in pdf.iterrows():
-        if r["phase"] in ["Downswing", "Impact"]:
-            window = (int(r["start"]), int(r["end"]))
-            break
-
-    s, e = window
-    cand_idx = np.argmax(score_curve[s:e+1]) + s
+    cand_idx = np.argmax(score_curve[s-lo:e-lo+1]) + s
     out = {"contact_frame": int(cand_idx), "window_start": int(s), "window_end": int(e)}
 
     import json
@@ -1,24 +1,46 @@
 from pathlib import Path
+from functools import lru_cache
 import json
 import pandas as pd
 import numpy as np
 from modules.logger import get_logger
 from modules.cache_manager import needs_update, update_cache
+from modules.table_io import OUTPUT_FORMAT, read_table
 
 logger = get_logger("evaluation")
 
-METRICS_FILE = Path("output/metrics_log.csv")
-PHASES_FILE = Path("output/phases.csv")
+METRICS_FILE = Path(f"output/metrics_log.{OUTPUT_FORMAT}")
+PHASES_FILE = Path(f"output/phases.{OUTPUT_FORMAT}")
 CONTACT_FILE = Path("output/contact.json")
 OUT_JSON = Path("output/evaluation.json")
 
 def _safe_mean(series):
-    s = series.dropna()
-    return float(s.mean()) if len(s) else None
+    m = series.mean()  # skips NaN; NaN when nothing is left
+    return None if pd.isna(m) else float(m)
 
 def _clip01(x): 
     return max(0.0, min(1.0, x))
 
+@lru_cache(maxsize=8)
+def _make_scorer(foot_target, hk_thr, elbow_target, spine_thr):
+    """Build a scorer with the thresholds baked in as constants (memoized per config)."""
+    hk_span = 2 * hk_thr
+    spine_span = 2 * spine_thr
+
+    def scorer(foot, hk, elbow, spine):
+        # Convert to 0-1 (later scaled to 1-10). Basic linear maps with clamp.
+        # Footwork: reward foot angle near ~30° (open but not too much)
+        foot_norm = 1.0 - min(1.0, abs((foot or foot_target) - foot_target) / 40.0)
+        # Head Position: reward small head-knee distance
+        hk_norm = 1.0 - min(1.0, (hk or hk_thr) / hk_span)
+        # Swing Control: elbow mean vs. target, treated as desirable minimum; good up to +40°
+        elbow_norm = _clip01(((elbow or elbow_target) - elbow_target) / 40.0)
+        # Balance: penalize spine lean
+        spine_norm = 1.0 - min(1.0, (spine or spine_thr) / spine_span)
+        return foot_norm, hk_norm, elbow_norm, spine_norm
+
+    return scorer
+
 def run(metrics_csv: Path = METRICS_FILE,
         phases_csv: Path = PHASES_FILE,
         contact_json: Path = CONTACT_FILE,
@@ -28,14 +50,14 @@ def run(metrics_csv: Path = METRICS_FILE,
     cfg = config or {}
     step_config = {"cfg": cfg}
 
-    if OUT_JSON.exists() and not needs_update("evaluation", [metrics_csv, phases_csv, contact_json], step_config):
+    if OUT_JSON.exists() and not needs_update("evaluation", [metrics_csv, phases_csv, contact_json, OUT_JSON], step_config):
         logger.info("Evaluation already up-to-date — skipping.")
         return OUT_JSON
 
     if not metrics_csv.exists():
         raise FileNotFoundError(f"Metrics missing: {metrics_csv}")
 
-    mdf = pd.read_csv(metrics_csv)
+    mdf = read_table(metrics_csv)
 
     # Pull representative values
     elbow = _safe_mean(mdf["elbow_angle"])                  # larger is generally “more extension”
@@ -43,27 +65,18 @@ def run(metrics_csv: Path = METRICS_FILE,
     hk    = _safe_mean(mdf["head_knee_distance"])           # smaller distance (still, steady head) is better
     foot  = _safe_mean(mdf["foot_angle"])                   # moderate open stance
 
-    # Convert to 0-1, then scale to 1-10. Basic linear maps with clamp.
-    # Footwork: reward foot angle near ~30° (open but not too much)
-    foot_target = 30.0
-    foot_norm = 1.0 - min(1.0, abs((foot or foot_target) - foot_target) / 40.0)
-
-    # Head Position: reward small head-knee distance
-    hk_thr = cfg.get("head_knee_distance_threshold", 15)
-    hk_norm = 1.0 - min(1.0, (hk or hk_thr) / (2*hk_thr))
-
-    # Swing Control: penalize excessive elbow angle variability — approximate by elbow mean vs. target
-    elbow_target = cfg.get("elbow_angle_threshold", 110)  # treat as desirable minimum
-    elbow_norm = _clip01(((elbow or elbow_target) - elbow_target) / 40.0)  # more than threshold → good up to +40°
-
-    # Balance: penalize spine lean
-    spine_thr = cfg.get("spine_lean_threshold", 10)
-    spine_norm = 1.0 - min(1.0, (spine or spine_thr) / (2*spine_thr))
+    scorer = _make_scorer(
+        30.0,
+        cfg.get("head_knee_distance_threshold", 15),
+        cfg.get("elbow_angle_threshold", 110),
+        cfg.get("spine_lean_threshold", 10),
+    )
+    foot_norm, hk_norm, elbow_norm, spine_norm = scorer(foot, hk, elbow, spine)
 
     # Follow-through: encourage continuation (proxy: post-impact wrist speed decay smoothness)
     # If we have phases, longer follow-through than downswing is generally good.
     try:
-        pdf = pd.read_csv(phases_csv)
+        pdf = read_table(phases_csv)
         downswing = pdf[pdf["phase"] == "Downswing"].iloc[0] if (pdf["phase"] == "Downswing").any() else None
         follow = pdf[pdf["phase"] == "Follow-through"].iloc[0] if (pdf["phase"] == "Follow-through").any() else None
         if downswing is not None and follow is not None:
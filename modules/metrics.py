@@ -1,42 +1,37 @@
-import math
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from modules.logger import get_logger
 from modules.cache_manager import needs_update, update_cache
+from modules.table_io import OUTPUT_FORMAT, read_table, write_table
 
 logger = get_logger("metrics")
 
-POSE_FILE = Path("output/pose_keypoints.csv")
-BAT_FILE = Path("output/bat_positions.csv")
-METRICS_FILE = Path("output/metrics_log.csv")
+POSE_FILE = Path(f"output/pose_keypoints.{OUTPUT_FORMAT}")
+BAT_FILE = Path(f"output/bat_positions.{OUTPUT_FORMAT}")
+METRICS_FILE = Path(f"output/metrics_log.{OUTPUT_FORMAT}")
 
-# Helper functions
+# Helper functions (work on scalars or NumPy arrays; NaN coordinates propagate)
 def angle_3pts(a, b, c):
     """Return angle at point b (in degrees) given three points (x,y)."""
-    if None in a or None in b or None in c:
-        return None
-    try:
-        ang = math.degrees(
-            math.atan2(c[1] - b[1], c[0] - b[0]) -
-            math.atan2(a[1] - b[1], a[0] - b[0])
-        )
-        return abs(ang) if ang >= 0 else abs(ang + 360)
-    except:
-        return None
+    ang = np.degrees(
+        np.arctan2(c[1] - b[1], c[0] - b[0]) -
+        np.arctan2(a[1] - b[1], a[0] - b[0])
+    )
+    return np.where(ang < 0, ang + 360, ang)
 
 def distance(a, b):
     """Euclidean distance between two points."""
-    if None in a or None in b:
-        return None
-    return math.sqrt((a[0] - b[0])**2 + (a[1] - b[1])**2)
+    return np.hypot(a[0] - b[0], a[1] - b[1])
 
-def run(pose_file: Path = POSE_FILE, bat_file: Path = BAT_FILE, config: dict = {}) -> Path:
+def run(pose_file: Path = POSE_FILE, bat_file: Path = BAT_FILE, config: dict = {}, state: dict = None) -> Path:
     """
     Computes biomechanical metrics for each frame:
     - Front elbow angle (shoulder–elbow–wrist)
     - Spine lean (hip–shoulder vs vertical)
     - Head-over-knee distance
     - Front foot direction (toe vs horizontal axis)
+    The loaded keypoints/bat tables and the result are kept in `state` for later steps.
     """
     step_config = {
         "thresholds": {
@@ -46,7 +41,7 @@ def run(pose_file: Path = POSE_FILE, bat_file: Path = BAT_FILE, config: dict = {
         }
     }
 
-    if METRICS_FILE.exists() and not needs_update("metrics", [pose_file, bat_file], step_config):
+    if METRICS_FILE.exists() and not needs_update("metrics", [pose_file, bat_file, METRICS_FILE], step_config):
         logger.info("Metrics already up-to-date — skipping.")
         return METRICS_FILE
 
@@ -54,54 +49,50 @@ def run(pose_file: Path = POSE_FILE, bat_file: Path = BAT_FILE, config: dict = {
         raise FileNotFoundError(f"Pose keypoints file missing: {pose_file}")
 
     # Load data
-    pose_df = pd.read_csv(pose_file)
-    bat_df = pd.read_csv(bat_file) if bat_file.exists() else pd.DataFrame(columns=["frame"])
-
-    metrics = []
-
-    for idx, row in pose_df.iterrows():
-        frame = row["frame"]
-
-        # Example: Assume front arm = left arm (Landmarks: 11=shoulder, 13=elbow, 15=wrist)
-        shoulder = (row["x_11"], row["y_11"])
-        elbow    = (row["x_13"], row["y_13"])
-        wrist    = (row["x_15"], row["y_15"])
-        elbow_angle = angle_3pts(shoulder, elbow, wrist)
-
-        # Spine lean: Compare shoulder-hip line vs vertical axis
-        hip = (row["x_23"], row["y_23"])
-        dy = shoulder[1] - hip[1]
-        dx = shoulder[0] - hip[0]
-        spine_angle = abs(math.degrees(math.atan2(dx, dy)))
-
-        # Head-over-knee distance (Landmarks: head=0, front knee=25)
-        head = (row["x_0"], row["y_0"])
-        knee = (row["x_25"], row["y_25"])
-        head_knee_dist = distance(head, knee)
-
-        # Foot direction (toe vs horizontal)
-        toe = (row["x_31"], row["y_31"])
-        heel = (row["x_29"], row["y_29"])
-        foot_angle = abs(math.degrees(math.atan2(toe[1] - heel[1], toe[0] - heel[0])))
-
-        # Get bat detection (if available)
-        bat_row = bat_df[bat_df["frame"] == frame]
-        if not bat_row.empty:
-            bat_coords = bat_row.iloc[0][["x1", "y1", "x2", "y2"]].tolist()
-        else:
-            bat_coords = [None, None, None, None]
-
-        metrics.append([
-            frame, elbow_angle, spine_angle, head_knee_dist, foot_angle,
-            *bat_coords
-        ])
-
-    metrics_df = pd.DataFrame(metrics, columns=[
-        "frame", "elbow_angle", "spine_angle", "head_knee_distance", "foot_angle",
-        "bat_x1", "bat_y1", "bat_x2", "bat_y2"
-    ])
-    METRICS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    metrics_df.to_csv(METRICS_FILE, index=False)
+    pose_df = read_table(pose_file)
+    bat_df = read_table(bat_file) if bat_file.exists() else pd.DataFrame(columns=["frame", "x1", "y1", "x2", "y2", "confidence"])
+    if state is not None:
+        state.update(keypoints_df=pose_df, bat_df=bat_df)
+
+    def col(name):
+        return pose_df[name].to_numpy(dtype=float)
+
+    # Example: Assume front arm = left arm (Landmarks: 11=shoulder, 13=elbow, 15=wrist)
+    shoulder = (col("x_11"), col("y_11"))
+    elbow    = (col("x_13"), col("y_13"))
+    wrist    = (col("x_15"), col("y_15"))
+    elbow_angle = angle_3pts(shoulder, elbow, wrist)
+
+    # Spine lean: Compare shoulder-hip line vs vertical axis
+    hip = (col("x_23"), col("y_23"))
+    spine_angle = np.abs(np.degrees(np.arctan2(shoulder[0] - hip[0], shoulder[1] - hip[1])))
+
+    # Head-over-knee distance (Landmarks: head=0, front knee=25)
+    head = (col("x_0"), col("y_0"))
+    knee = (col("x_25"), col("y_25"))
+    head_knee_dist = distance(head, knee)
+
+    # Foot direction (toe vs horizontal)
+    foot_angle = np.abs(np.degrees(np.arctan2(col("y_31") - col("y_29"), col("x_31") - col("x_29"))))
+
+    metrics_df = pd.DataFrame({
+        "frame": pose_df["frame"],
+        "elbow_angle": elbow_angle,
+        "spine_angle": spine_angle,
+        "head_knee_distance": head_knee_dist,
+        "foot_angle": foot_angle,
+    })
+
+    # Attach the most confident bat detection per frame (if available), built once and joined
+    bat_top = (bat_df.sort_values(["frame", "confidence"], ascending=[True, False])
+                     .drop_duplicates("frame")
+                     .set_index("frame")[["x1", "y1", "x2", "y2"]]
+                     .rename(columns={"x1": "bat_x1", "y1": "bat_y1", "x2": "bat_x2", "y2": "bat_y2"}))
+    metrics_df = metrics_df.merge(bat_top, left_on="frame", right_index=True, how="left")
+
+    write_table(metrics_df, METRICS_FILE)
+    if state is not None:
+        state["metrics_df"] = metrics_df
 
     logger.info(f"Metrics saved to {METRICS_FILE}")
 
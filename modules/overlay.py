@@ -1,67 +1,203 @@
 import cv2
+import multiprocessing
+import numpy as np
 import pandas as pd
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from modules.logger import get_logger
 from modules.cache_manager import needs_update, update_cache
+from modules.table_io import OUTPUT_FORMAT, read_table
+from modules.video_io import X264_SINGLE_THREAD, open_capture, open_writer
 
 logger = get_logger("overlay")
 
 VIDEO_PATH = Path("output/normalized_video.mp4")
-KEYPOINTS_FILE = Path("output/pose_keypoints.csv")
-BAT_FILE = Path("output/bat_positions.csv")
-METRICS_FILE = Path("output/metrics_log.csv")
+KEYPOINTS_FILE = Path(f"output/pose_keypoints.{OUTPUT_FORMAT}")
+BAT_FILE = Path(f"output/bat_positions.{OUTPUT_FORMAT}")
+METRICS_FILE = Path(f"output/metrics_log.{OUTPUT_FORMAT}")
 OUT_VIDEO = Path("output/annotated_video.mp4")
+MIN_CHUNK_FRAMES = 30  # don't split the render into chunks shorter than this
 
 POSE_CONNECTIONS = [
     (11, 13), (13, 15), (12, 14), (14, 16),
     (11, 12), (23, 25), (25, 27), (24, 26),
     (26, 28), (23, 24), (11, 23), (12, 24)
 ]
+# Keypoints are stored as fixed-point ints with this many fractional bits (1/8 px) and drawn with `shift`
+POSE_SHIFT = 3
 
-def _draw_pose(frame, row, w, h):
+
+def _draw_pose(frame, xs, ys, valid, conn_valid):
+    """Draw landmarks and skeleton from one frame's precomputed fixed-point coords and
+    landmark/connection validity flags."""
+    radius = 3 << POSE_SHIFT
     for i in range(33):
-        x = row.get(f"x_{i}"); y = row.get(f"y_{i}"); v = row.get(f"v_{i}")
-        if pd.notnull(x) and pd.notnull(y) and (v is None or v > 0.3):
-            cv2.circle(frame, (int(x*w), int(y*h)), 3, (255, 255, 255), -1)
-    for a, b in POSE_CONNECTIONS:
-        xa, ya, va = row.get(f"x_{a}"), row.get(f"y_{a}"), row.get(f"v_{a}")
-        xb, yb, vb = row.get(f"x_{b}"), row.get(f"y_{b}"), row.get(f"v_{b}")
-        if pd.notnull(xa) and pd.notnull(ya) and pd.notnull(xb) and pd.notnull(yb):
-            if (va is None or va>0.3) and (vb is None or vb>0.3):
-                cv2.line(frame, (int(xa*w), int(ya*h)), (int(xb*w), int(yb*h)), (255,255,255), 2)
+        if valid[i]:
+            cv2.circle(frame, (xs[i], ys[i]), radius, (255, 255, 255), -1, cv2.LINE_AA, POSE_SHIFT)
+    for (a, b), ok in zip(POSE_CONNECTIONS, conn_valid):
+        if ok:
+            cv2.line(frame, (xs[a], ys[a]), (xs[b], ys[b]), (255,255,255), 2, cv2.LINE_AA, POSE_SHIFT)
 
 def _draw_bat(frame, bat_rows):
     if not bat_rows: return
     for b in bat_rows:
         x1, y1, x2, y2, conf = b
-        if pd.notnull(x1) and pd.notnull(y1) and pd.notnull(x2) and pd.notnull(y2):
-            cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (60, 220, 60), 2)
-            cv2.putText(frame, f"Bat {conf:.2f}", (int(x1), max(15,int(y1-8))),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (60,220,60), 2)
-
-def _draw_metrics_panel(frame, mrow, cfg):
-    cv2.rectangle(frame, (10,10), (330,110), (0,0,0), -1)
-    cv2.rectangle(frame, (10,10), (330,110), (255,255,255), 1)
-    elbow = mrow.get("elbow_angle"); spine = mrow.get("spine_angle")
-    hk = mrow.get("head_knee_distance"); foot = mrow.get("foot_angle")
+        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (60, 220, 60), 2)
+        cv2.putText(frame, f"Bat {conf:.2f}", (int(x1), max(15,int(y1-8))),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (60,220,60), 2)
+
+def _make_text_sprite(text, scale, color, thickness):
+    """
+    Rasterize `text` once into a solid-colour sprite + 0/255 coverage mask.
+    Returns (sprite, mask, (dx, dy)) where (dx, dy) is the sprite's offset from the putText origin,
+    or the putText arguments (text, scale, color, thickness) if this OpenCV antialiases text
+    (OpenCV 5), since a masked copy can't reproduce partial coverage.
+    """
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    (tw, th), baseline = cv2.getTextSize(text, font, scale, thickness)
+    pad = 2 * thickness + 2
+    shape = (th + baseline + 2*pad, tw + 2*pad)
+    mask = np.zeros(shape, np.uint8)
+    cv2.putText(mask, text, (pad, pad + th), font, scale, 255, thickness)
+    if not np.isin(mask, (0, 255)).all():
+        return text, scale, color, thickness
+    sprite = np.empty(shape + (3,), np.uint8)
+    sprite[:] = color
+    return sprite, mask, (-pad, -(pad + th))
+
+def _make_panel_sprite():
+    """Metrics panel background (black box, white border) drawn once; fully opaque, so no mask."""
+    sprite = np.zeros((101, 321, 3), np.uint8)
+    cv2.rectangle(sprite, (0,0), (320,100), (255,255,255), 1)
+    return sprite, None, (0, 0)
+
+def _blit(frame, sprite_info, org):
+    """Copy a sprite into `frame` at putText-style origin `org` through its mask (if any), clipped to the frame."""
+    sprite, mask, (dx, dy) = sprite_info
+    x0, y0 = org[0] + dx, org[1] + dy
+    fh, fw = frame.shape[:2]
+    fx0, fy0 = max(0, x0), max(0, y0)
+    fx1, fy1 = min(fw, x0 + sprite.shape[1]), min(fh, y0 + sprite.shape[0])
+    if fx1 <= fx0 or fy1 <= fy0:
+        return
+    sl = (slice(fy0 - y0, fy1 - y0), slice(fx0 - x0, fx1 - x0))
+    roi = frame[fy0:fy1, fx0:fx1]
+    if mask is None:
+        roi[:] = sprite[sl]
+    else:
+        cv2.copyTo(sprite[sl], mask[sl], roi)
+
+def _draw_label(frame, label, org):
+    """Draw a label from _make_text_sprite: blit the sprite, or putText when it was kept as text."""
+    if isinstance(label[0], str):
+        cv2.putText(frame, label[0], org, cv2.FONT_HERSHEY_SIMPLEX, *label[1:])
+    else:
+        _blit(frame, label, org)
+
+PANEL_SPRITE = _make_panel_sprite()
+
+def _metric_lines(met_df: pd.DataFrame, cfg: dict) -> dict:
+    """Format the metrics panel text for every frame up front: frame -> tuple of display lines."""
     elbow_thr = cfg.get("elbow_angle_threshold", 110)
     spine_thr = cfg.get("spine_lean_threshold", 10)
     hk_thr = cfg.get("head_knee_distance_threshold", 15)
-    def flag(val, thr, good_when_less=True):
-        if pd.isnull(val): return "NULL"
-        ok = val < thr if good_when_less else val > thr
-        return "Done" if ok else "Note done"
-    lines = [
-        f"Elbow Angle: {None if pd.isnull(elbow) else round(elbow,1)}°  {flag(elbow, elbow_thr, good_when_less=False)}",
-        f"Spine Lean : {None if pd.isnull(spine) else round(spine,1)}°  {flag(spine, spine_thr)}",
-        f"Head-Knee  : {None if pd.isnull(hk) else round(hk,3)}  {flag(hk, hk_thr)}",
-        f"Foot Angle : {None if pd.isnull(foot) else round(foot,1)}°"
-    ]
+    def fmt(col, nd):
+        return ["None" if pd.isnull(v) else str(round(v, nd)) for v in met_df[col].tolist()]
+    def flag(col, thr, good_when_less=True):
+        vals = met_df[col].to_numpy(dtype=float)
+        ok = vals < thr if good_when_less else vals > thr
+        return np.where(np.isnan(vals), "NULL", np.where(ok, "Done", "Note done")).tolist()
+    lines = zip(
+        [f"Elbow Angle: {v}°  {f}" for v, f in zip(fmt("elbow_angle", 1), flag("elbow_angle", elbow_thr, good_when_less=False))],
+        [f"Spine Lean : {v}°  {f}" for v, f in zip(fmt("spine_angle", 1), flag("spine_angle", spine_thr))],
+        [f"Head-Knee  : {v}  {f}" for v, f in zip(fmt("head_knee_distance", 3), flag("head_knee_distance", hk_thr))],
+        [f"Foot Angle : {v}°" for v in fmt("foot_angle", 1)],
+    )
+    return dict(zip(met_df["frame"].tolist(), lines))
+
+def _draw_metrics_panel(frame, lines):
+    _blit(frame, PANEL_SPRITE, (10, 10))
     y = 35
     for text in lines:
         cv2.putText(frame, text, (20,y), cv2.FONT_HERSHEY_SIMPLEX, 0.55, (255,255,255),1)
         y+=20
 
+def _open_at(video_path: Path, start: int) -> cv2.VideoCapture:
+    """Open the video positioned at frame `start`: seek, and grab forward if the seek is not frame-accurate."""
+    cap = open_capture(video_path)
+    if start == 0:
+        return cap
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+        return cap
+    cap.release()
+    cap = open_capture(video_path)
+    for _ in range(start):
+        if not cap.grab(): break
+    return cap
+
+def _render_range(ctx: dict, start: int, end: float, out_path: Path, encoder_args: tuple = None) -> int:
+    """Render frames start..end (inclusive) of ctx["video_path"] to out_path; returns frames written."""
+    w, h = ctx["size"]
+    cap = _open_at(ctx["video_path"], start)
+    out = open_writer(out_path, ctx["fps"], (w,h), encoder_args)
+    kp_xs, kp_ys, kp_valid, conn_valid = ctx["kp_xs"], ctx["kp_ys"], ctx["kp_valid"], ctx["conn_valid"]
+    frame_to_row, bat_map, met_line_map = ctx["frame_to_row"], ctx["bat_map"], ctx["met_line_map"]
+    phase_arr, phase_sprites = ctx["phase_arr"], ctx["phase_sprites"]
+    contact_frame = ctx["contact_frame"]
+
+    frame_idx = start
+    while frame_idx <= end:
+        ret, frame = cap.read()
+        if not ret: break
+
+        r = frame_to_row.get(frame_idx)
+        if r is not None:
+            _draw_pose(frame, kp_xs[r].tolist(), kp_ys[r].tolist(), kp_valid[r].tolist(), conn_valid[r].tolist())
+        if frame_idx in bat_map: _draw_bat(frame, bat_map[frame_idx])
+        if frame_idx in met_line_map: _draw_metrics_panel(frame, met_line_map[frame_idx])
+
+        # Phase display
+        phase = phase_arr[frame_idx] if frame_idx < len(phase_arr) else None
+        if phase is not None:
+            _draw_label(frame, phase_sprites[phase], (10, h-40))
+
+        # Contact frame highlight
+        if contact_frame is not None and frame_idx==contact_frame:
+            _draw_label(frame, ctx["contact_sprite"], (w//2-80, h//2))
+
+        _draw_label(frame, ctx["banner_sprite"], (10, h-12))
+        out.write(frame)
+        frame_idx += 1
+        if frame_idx % 50 == 0:
+            logger.info(f"Overlayed {frame_idx} frames...")
+
+    cap.release()
+    out.release()
+    return frame_idx - start
+
+def _render_parallel(ctx: dict, start: int, last: int, end: float, workers: int):
+    """Render [start, end] as `workers` frame-range chunks in separate processes, then concat losslessly.
+    `last` is the expected final frame used for splitting; the final chunk still runs to `end`/EOF."""
+    bounds = np.linspace(start, last + 1, workers + 1).astype(int)
+    ends = (bounds[1:] - 1).tolist()
+    ends[-1] = end
+    with tempfile.TemporaryDirectory(dir=OUT_VIDEO.parent) as tmp:
+        chunks = [Path(tmp) / f"chunk_{i:03d}.mp4" for i in range(workers)]
+        # One OpenCV thread and one single-threaded libx264 encoder per worker, so the processes
+        # don't oversubscribe the cores or exceed the driver's concurrent NVENC session limit
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=cv2.setNumThreads, initargs=(1,)) as ex:
+            list(ex.map(_render_range, [ctx] * workers, bounds[:-1].tolist(), ends, chunks,
+                        [X264_SINGLE_THREAD] * workers))
+        list_file = Path(tmp) / "chunks.txt"
+        list_file.write_text("".join(f"file '{c.resolve()}'\n" for c in chunks))
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                        "-i", str(list_file), "-c", "copy", str(OUT_VIDEO)], check=True)
+
 def run(
     video_path: Path = VIDEO_PATH,
     keypoints_csv: Path = KEYPOINTS_FILE,
@@ -69,13 +205,23 @@ def run(
     metrics_csv: Path = METRICS_FILE,
     phases_csv: Path = None,
     contact_file: Path = None,
-    config: dict = None
+    config: dict = None,
+    contact_window: int = None,
+    state: dict = None,
+    workers: int = 1
 ) -> Path:
+    """
+    Render the annotated video. With `contact_window` set, only frames within
+    contact_frame ± contact_window are rendered; earlier frames are skipped by seeking.
+    DataFrames already loaded by earlier steps (`state`) are used instead of re-reading the files.
+    With workers > 1 (and ffmpeg available) frame ranges are rendered in parallel processes, each
+    encoding with single-threaded libx264; if any chunk fails the whole range is rendered serially.
+    """
     cfg = config or {}
-    step_config = {"thresholds": cfg}
+    step_config = {"thresholds": cfg, "contact_window": contact_window}
 
     if OUT_VIDEO.exists() and not needs_update("overlay",
-        [video_path, keypoints_csv, bat_csv, metrics_csv, phases_csv, contact_file],
+        [video_path, keypoints_csv, bat_csv, metrics_csv, phases_csv, contact_file, OUT_VIDEO],
         step_config
     ):
         logger.info("Annotated video up-to-date — skipping.")
@@ -85,17 +231,32 @@ def run(
     if not keypoints_csv.exists(): raise FileNotFoundError(f"Keypoints missing: {keypoints_csv}")
     if not metrics_csv.exists(): raise FileNotFoundError(f"Metrics missing: {metrics_csv}")
 
-    kp_df = pd.read_csv(keypoints_csv)
-    bat_df = pd.read_csv(bat_csv) if bat_csv and bat_csv.exists() else pd.DataFrame(columns=["frame"])
-    met_df = pd.read_csv(metrics_csv)
+    state = state or {}
+    kp_df = state.get("keypoints_df")
+    if kp_df is None:
+        kp_df = read_table(keypoints_csv)
+    bat_df = state.get("bat_df")
+    if bat_df is None:
+        bat_df = read_table(bat_csv) if bat_csv and bat_csv.exists() else pd.DataFrame(columns=["frame"])
+    met_df = state.get("metrics_df")
+    if met_df is None:
+        met_df = read_table(metrics_csv)
 
-    # Phase map
-    phase_map = {}
+    # Frame -> phase lookup array (+ one pre-rendered label sprite per phase name)
+    phase_arr = np.empty(0, dtype=object)
+    phase_sprites = {}
     if phases_csv and phases_csv.exists():
-        pdf = pd.read_csv(phases_csv)
-        for _, r in pdf.iterrows():
-            for f in range(int(r["start"]), int(r["end"])+1):
-                phase_map[f] = r["phase"]
+        pdf = state.get("phases_df")
+        if pdf is None:
+            pdf = read_table(phases_csv)
+        if len(pdf):
+            starts = pdf["start"].to_numpy(dtype=int)
+            ends = pdf["end"].to_numpy(dtype=int)
+            phase_arr = np.full(ends.max() + 1, None, dtype=object)
+            for s, e, p in zip(starts, ends, pdf["phase"].to_numpy()):
+                phase_arr[s:e+1] = p
+        for name in pdf["phase"].unique():
+            phase_sprites[name] = _make_text_sprite(f"Phase: {name}", 0.7, (0,255,255), 2)
 
     # Contact frame
     contact_frame = None
@@ -107,48 +268,68 @@ def run(
     # Bat map
     bat_map = {}
     if not bat_df.empty:
-        for frame_num, group in bat_df.groupby("frame"):
-            bat_map[frame_num] = [(row["x1"], row["y1"], row["x2"], row["y2"], row["confidence"]) for _, row in group.iterrows()]
+        # Bucket detection rows by frame with one sort + split instead of groupby/iterrows;
+        # boxes with missing coordinates are dropped here rather than checked per frame
+        bat_df = bat_df.dropna(subset=["x1", "y1", "x2", "y2"]).sort_values("frame", kind="stable")
+        frames = bat_df["frame"].to_numpy(dtype=np.int64)
+        boxes = bat_df[["x1", "y1", "x2", "y2", "confidence"]].to_numpy(dtype=np.float64)
+        _, starts = np.unique(frames, return_index=True)
+        groups = np.split(boxes, starts[1:])
+        bat_map = dict(zip(frames[starts].tolist(), [list(map(tuple, g.tolist())) for g in groups]))
 
-    met_map = met_df.set_index("frame").to_dict("index")
+    met_line_map = _metric_lines(met_df, cfg)
 
-    cap = cv2.VideoCapture(str(video_path))
+    cap = open_capture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
     w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    out = cv2.VideoWriter(str(OUT_VIDEO), cv2.VideoWriter_fourcc(*'mp4v'), fps, (w,h))
-
-    frame_idx = 0
-    logger.info("Drawing overlays...")
-    while True:
-        ret, frame = cap.read()
-        if not ret: break
-
-        if not kp_df[kp_df["frame"]==frame_idx].empty:
-            _draw_pose(frame, kp_df[kp_df["frame"]==frame_idx].iloc[0], w, h)
-        if frame_idx in bat_map: _draw_bat(frame, bat_map[frame_idx])
-        if frame_idx in met_map: _draw_metrics_panel(frame, met_map[frame_idx], cfg)
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
 
-        # Phase display
-        if frame_idx in phase_map:
-            cv2.putText(frame, f"Phase: {phase_map[frame_idx]}", (10, h-40),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,255),2)
+    # Keypoints -> (N,33) fixed-point sub-pixel coords + landmark (N,33) and connection (N,12)
+    # validity masks, computed once
+    kx = kp_df[[f"x_{i}" for i in range(33)]].to_numpy(dtype=float)
+    ky = kp_df[[f"y_{i}" for i in range(33)]].to_numpy(dtype=float)
+    kv = kp_df[[f"v_{i}" for i in range(33)]].to_numpy(dtype=float)
+    kp_valid = (kv > 0.3) & ~np.isnan(kx) & ~np.isnan(ky)
+    conn_a, conn_b = np.array(POSE_CONNECTIONS).T
 
-        # Contact frame highlight
-        if contact_frame is not None and frame_idx==contact_frame:
-            cv2.putText(frame, "CONTACT", (w//2-80, h//2),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0,0,255), 3)
+    # Everything a renderer needs, precomputed once and picklable for worker processes
+    ctx = {
+        "video_path": video_path, "fps": fps, "size": (w, h),
+        "kp_valid": kp_valid,
+        "conn_valid": kp_valid[:, conn_a] & kp_valid[:, conn_b],
+        "kp_xs": np.rint(np.nan_to_num(kx * (w << POSE_SHIFT))).astype(np.int32),
+        "kp_ys": np.rint(np.nan_to_num(ky * (h << POSE_SHIFT))).astype(np.int32),
+        "frame_to_row": dict(zip(kp_df["frame"].astype(int), range(len(kp_df)))),
+        "bat_map": bat_map, "met_line_map": met_line_map,
+        "phase_arr": phase_arr, "phase_sprites": phase_sprites,
+        "contact_frame": contact_frame,
+        # Static labels are rasterized once and copied in per frame
+        "contact_sprite": _make_text_sprite("CONTACT", 1.2, (0,0,255), 3),
+        "banner_sprite": _make_text_sprite("AthleteRise: Cover Drive Analysis", 0.6, (240,240,240), 2),
+    }
 
-        cv2.putText(frame, "AthleteRise: Cover Drive Analysis", (10,h-12),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (240,240,240),2)
-        out.write(frame)
-        frame_idx += 1
-        if frame_idx % 50 == 0:
-            logger.info(f"Overlayed {frame_idx} frames...")
+    # Frame range to render
+    start, end = 0, float("inf")
+    if contact_window is not None and contact_frame is not None:
+        start, end = max(0, contact_frame - contact_window), contact_frame + contact_window
+        logger.info(f"Rendering contact window: frames {start}-{end}")
 
-    cap.release()
-    out.release()
+    logger.info("Drawing overlays...")
+    last = min(end, n_frames - 1)
+    workers = min(workers, (last - start + 1) // MIN_CHUNK_FRAMES) if n_frames > 0 else 1
+    if workers > 1 and shutil.which("ffmpeg"):
+        logger.info(f"Rendering frames {start}-{last} in {workers} parallel chunks")
+        try:
+            _render_parallel(ctx, start, last, end, workers)
+        except Exception as e:
+            logger.warning(f"⚠ Parallel render failed ({e}) — rendering serially")
+            _render_range(ctx, start, end, OUT_VIDEO)
+    else:
+        _render_range(ctx, start, end, OUT_VIDEO)
     logger.info(f"Annotated video saved: {OUT_VIDEO}")
 
-    update_cache("overlay", [video_path, keypoints_csv, bat_csv, metrics_csv, OUT_VIDEO], step_config)
+    update_cache("overlay", [video_path, keypoints_csv, bat_csv, metrics_csv, phases_csv, contact_file, OUT_VIDEO],
+                 step_config)
     return OUT_VIDEO
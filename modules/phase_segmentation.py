@@ -3,49 +3,54 @@ import pandas as pd
 import numpy as np
 from modules.logger import get_logger
 from modules.cache_manager import needs_update, update_cache
+from modules.table_io import OUTPUT_FORMAT, read_table, write_table
 
 logger = get_logger("phase_segmentation")
 
-IN_KPTS = Path("output/pose_keypoints.csv")
-OUT_PHASES = Path("output/phases.csv")
-
-# Helper: finite difference speed (per-frame Euclidean velocity) for a keypoint
-def _vel(df: pd.DataFrame, k: int) -> np.ndarray:
-    x = df[f"x_{k}"].values
-    y = df[f"y_{k}"].values
-    # normalize by shoulder width to reduce scale sensitivity
-    sh_w = np.maximum(1e-6, np.sqrt((df["x_11"]-df["x_12"])**2 + (df["y_11"]-df["y_12"])**2).values)
-    vx = np.gradient(x)
-    vy = np.gradient(y)
-    v = np.sqrt(vx**2 + vy**2) / sh_w
-    return np.nan_to_num(v, nan=0.0, posinf=0.0, neginf=0.0)
-
-# Simple shoulder-line angle (torso orientation proxy)
-def _torso_angle(df: pd.DataFrame) -> np.ndarray:
-    dx = (df["x_12"] - df["x_11"]).values
-    dy = (df["y_12"] - df["y_11"]).values
-    ang = np.degrees(np.arctan2(dy, dx))
-    return np.nan_to_num(ang)
-
-def run(pose_csv: Path = IN_KPTS) -> Path:
-    """Heuristic phase segmentation using wrist velocity + torso angle dynamics."""
+IN_KPTS = Path(f"output/pose_keypoints.{OUTPUT_FORMAT}")
+OUT_PHASES = Path(f"output/phases.{OUTPUT_FORMAT}")
+
+PHASE_ORDER = ["Stance", "Stride", "Downswing", "Impact", "Follow-through", "Recovery"]
+KIN_COLS = ["x_11", "y_11", "x_12", "y_12", "x_15", "y_15", "x_16", "y_16"]
+
+# Helper: wrist speed (max of both wrists, per-frame Euclidean velocity normalized by
+# shoulder width) and shoulder-line angle (torso orientation proxy), from one array pull
+def _kinematics(df: pd.DataFrame):
+    A = df[KIN_COLS].to_numpy(dtype=np.float64)
+    dx = A[:, 2] - A[:, 0]
+    dy = A[:, 3] - A[:, 1]
+    # normalize by shoulder width to reduce scale sensitivity (computed once for both wrists)
+    sh_w = np.maximum(1e-6, np.hypot(dx, dy))
+
+    def vel(xc, yc):
+        v = np.hypot(np.gradient(A[:, xc]), np.gradient(A[:, yc])) / sh_w
+        return np.nan_to_num(v, nan=0.0, posinf=0.0, neginf=0.0)
+
+    # handle handedness automatically: right wrist(16) or left wrist(15)
+    wrist_v = np.maximum(vel(6, 7), vel(4, 5))
+    torso = np.nan_to_num(np.degrees(np.arctan2(dy, dx)))
+    return wrist_v, torso
+
+def run(pose_csv: Path = IN_KPTS, state: dict = None) -> Path:
+    """
+    Heuristic phase segmentation using wrist velocity + torso angle dynamics.
+    Uses state["keypoints_df"] when an earlier step already loaded it, and stores state["phases_df"].
+    """
     pose_csv = Path(pose_csv)
     step_config = {"pose_csv": str(pose_csv)}
 
-    if OUT_PHASES.exists() and not needs_update("phase_segmentation", [pose_csv], step_config):
+    if OUT_PHASES.exists() and not needs_update("phase_segmentation", [pose_csv, OUT_PHASES], step_config):
         logger.info("Phases already computed — skipping.")
         return OUT_PHASES
 
     if not pose_csv.exists():
         raise FileNotFoundError(f"Pose keypoints missing: {pose_csv}")
 
-    df = pd.read_csv(pose_csv)
-    # assume right-handed: right wrist(16), right elbow(14); fall back to left if right missing
-    rw_v = _vel(df, 16)
-    lw_v = _vel(df, 15)
-    wrist_v = np.maximum(rw_v, lw_v)  # handle handedness automatically
-
-    torso = _torso_angle(df)
+    if state and state.get("keypoints_df") is not None:
+        df = state["keypoints_df"][["frame"] + KIN_COLS]
+    else:
+        df = read_table(pose_csv, columns=["frame"] + KIN_COLS)
+    wrist_v, torso = _kinematics(df)
     d_torso = np.abs(np.gradient(torso))
 
     # Heuristics (tune thresholds if needed)
@@ -53,62 +58,38 @@ def run(pose_csv: Path = IN_KPTS) -> Path:
     swing_v = np.percentile(wrist_v, 75)
     rotate_thr = np.percentile(d_torso, 70)
 
-    # State machine
+    # Transition masks, one per state change, evaluated over all frames at once
+    prev_v = np.concatenate([[0.0], wrist_v[:-1]])
+    peaked = (prev_v > wrist_v) & (prev_v > swing_v)   # drop after peak means impact happened
+    peaked[:3] = False
+    transitions = [
+        ("Stance", (wrist_v > idle_v * 1.5) | (d_torso > rotate_thr * 0.7)),
+        ("Stride", (wrist_v > swing_v * 0.7) | (d_torso > rotate_thr)),
+        ("Downswing", peaked),
+        ("Impact", wrist_v < swing_v * 0.9),
+        ("Follow-through", (wrist_v < idle_v * 1.2) & (d_torso < rotate_thr * 0.5)),
+    ]
+
+    # Chain the transitions: each state ends at the first frame after the previous boundary
+    # where its exit condition holds
     frames = df["frame"].values
     phases = []
-    state = "Stance"
-    start_idx = int(frames[0])
-
-    def push_phase(name, s, e):
-        phases.append({"phase": name, "start": int(s), "end": int(e)})
-
-    for i, f in enumerate(frames[1:], start=1):
-        v = wrist_v[i]
-        rot = d_torso[i]
-
-        if state == "Stance":
-            if v > idle_v * 1.5 or rot > rotate_thr * 0.7:
-                push_phase("Stance", start_idx, frames[i-1])
-                state = "Stride"
-                start_idx = f
-
-        elif state == "Stride":
-            # approaching bat lift / early motion
-            if v > swing_v * 0.7 or rot > rotate_thr:
-                push_phase("Stride", start_idx, frames[i-1])
-                state = "Downswing"
-                start_idx = f
-
-        elif state == "Downswing":
-            # peak wrist velocity typically near impact
-            # drop after peak means impact happened
-            if i > 2 and wrist_v[i-1] > wrist_v[i] and wrist_v[i-1] > swing_v:
-                push_phase("Downswing", start_idx, frames[i-1])
-                state = "Impact"
-                start_idx = f
-
-        elif state == "Impact":
-            # Impact is brief; move quickly to Follow-through
-            if v < swing_v * 0.9:
-                push_phase("Impact", start_idx, frames[i-1])
-                state = "Follow-through"
-                start_idx = f
-
-        elif state == "Follow-through":
-            # velocities decaying
-            if v < idle_v * 1.2 and rot < rotate_thr * 0.5:
-                push_phase("Follow-through", start_idx, frames[i-1])
-                state = "Recovery"
-                start_idx = f
-
-        elif state == "Recovery":
-            # end of action
-            pass
+    phase, pos = "Stance", 0
+    for name, cond in transitions:
+        hits = np.flatnonzero(cond[pos + 1:])
+        if not hits.size:
+            break
+        i = pos + 1 + int(hits[0])
+        phases.append({"phase": name, "start": int(frames[pos]), "end": int(frames[i-1])})
+        phase, pos = PHASE_ORDER[PHASE_ORDER.index(name) + 1], i
 
     # flush last state
-    push_phase(state, start_idx, int(frames[-1]))
+    phases.append({"phase": phase, "start": int(frames[pos]), "end": int(frames[-1])})
 
-    pd.DataFrame(phases).to_csv(OUT_PHASES, index=False)
+    phases_df = pd.DataFrame(phases)
+    write_table(phases_df, OUT_PHASES)
+    if state is not None:
+        state["phases_df"] = phases_df
     logger.info(f"Phases saved: {OUT_PHASES}")
     update_cache("phase_segmentation", [pose_csv, OUT_PHASES], step_config)
     return OUT_PHASES
@@ -1,74 +1,148 @@
 import cv2
-import mediapipe as mp
+import numpy as np
 import pandas as pd
+import queue
+import threading
 from pathlib import Path
 from modules.logger import get_logger
 from modules.cache_manager import needs_update, update_cache
+from modules.table_io import OUTPUT_FORMAT, write_table
+from modules.video_io import open_capture
 
 logger = get_logger("pose_estimation")
 
 PROCESSED_VIDEO = Path("output/normalized_video.mp4")
-KEYPOINTS_FILE = Path("output/pose_keypoints.csv")
+KEYPOINTS_FILE = Path(f"output/pose_keypoints.{OUTPUT_FORMAT}")
 
-mp_pose = mp.solutions.pose
-mp_drawing = mp.solutions.drawing_utils
 
-def run(video_path: Path = PROCESSED_VIDEO) -> Path:
+def _producer(cap: cv2.VideoCapture, sample_stride: int, input_side: int, q: queue.Queue, stop: threading.Event):
+    """Decode, optionally downscale (shortest side to `input_side`) + colour-convert sampled frames on a
+    background thread, pushing (idx, rgb) tuples and a (frames_read, None) sentinel on EOF."""
+    frame_idx = 0
+    small_size = None
+    try:
+        while not stop.is_set() and cap.grab():
+            # Skipped frames are grabbed (demuxed) but never retrieved, converted or inferred
+            if frame_idx % sample_stride == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                if small_size is None:
+                    h, w = frame.shape[:2]
+                    scale = min(1.0, input_side / min(h, w)) if input_side else 1.0
+                    small_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+                if small_size != (frame.shape[1], frame.shape[0]):
+                    frame = cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA)
+                q.put((frame_idx, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+            frame_idx += 1
+    finally:
+        q.put((frame_idx, None))
+
+
+def _step_config(sample_stride: int, model_complexity: int, input_side: int) -> dict:
+    return {"pose_model": "mediapipe", "landmarks": 33, "sample_stride": sample_stride,
+            "model_complexity": model_complexity, "input_side": input_side}
+
+
+def up_to_date(video_path: Path = PROCESSED_VIDEO, sample_stride: int = 1, model_complexity: int = 0,
+               input_side: int = None) -> bool:
+    """Cheap cache check (no MediaPipe import) so callers can skip launching the step at all."""
+    return KEYPOINTS_FILE.exists() and not needs_update(
+        "pose_estimation", [Path(video_path), KEYPOINTS_FILE], _step_config(sample_stride, model_complexity, input_side))
+
+
+def run(video_path: Path = PROCESSED_VIDEO, sample_stride: int = 1, model_complexity: int = 0,
+        input_side: int = None) -> Path:
     """
-    Runs MediaPipe Pose on the normalized video and saves keypoints to a CSV file.
+    Runs MediaPipe Pose on the normalized video and saves keypoints to a Parquet file.
     Each row contains frame number + (x,y,visibility) for each landmark.
+    With sample_stride > 1 only every Nth frame is processed; skipped frames between two
+    detected samples are linearly interpolated (others stay NaN) so downstream modules
+    still get one row per frame.
+    model_complexity 0 is the BlazePose lite model (fastest); 1/2 trade speed for accuracy.
+    input_side downscales frames to that shortest side before inference (None = full resolution);
+    landmarks are normalized, but the landmark model crops the person from the smaller frame,
+    so wrist accuracy drops.
     """
-    step_config = {"pose_model": "mediapipe", "landmarks": 33}
+    step_config = _step_config(sample_stride, model_complexity, input_side)
 
-    if KEYPOINTS_FILE.exists() and not needs_update("pose_estimation", [video_path], step_config):
+    if KEYPOINTS_FILE.exists() and not needs_update("pose_estimation", [video_path, KEYPOINTS_FILE], step_config):
         logger.info("Pose keypoints already up-to-date — skipping.")
         return KEYPOINTS_FILE
 
+    # Imported only once we know the step has to run: a cached run never pays for MediaPipe
+    import mediapipe as mp
+
     if not video_path.exists():
         raise FileNotFoundError(f"Normalized video not found: {video_path}")
 
     logger.info("Starting pose estimation using MediaPipe Pose...")
 
-    cap = cv2.VideoCapture(str(video_path))
-    pose = mp_pose.Pose(static_image_mode=False, model_complexity=1, enable_segmentation=False)
-
-    all_keypoints = []
-    frame_idx = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = pose.process(rgb_frame)
-
-        if results.pose_landmarks:
-            landmarks = results.pose_landmarks.landmark
-            row = [frame_idx]
-            for lm in landmarks:
-                row.extend([lm.x, lm.y, lm.visibility])
-            all_keypoints.append(row)
-        else:
-            # Fill with NaNs if no detection
-            row = [frame_idx] + [None] * (33 * 3)
-            all_keypoints.append(row)
-
-        frame_idx += 1
-        if frame_idx % 50 == 0:
-            logger.info(f"Processed {frame_idx} frames for pose...")
-
-    cap.release()
-    pose.close()
+    cap = open_capture(video_path)
+    pose = mp.solutions.pose.Pose(static_image_mode=False, model_complexity=model_complexity, enable_segmentation=False)
+
+    # Preallocated (rows, frame + 33*(x,y,v)) float32 buffer; rows default to NaN (no detection)
+    est_rows = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) // sample_stride + 1
+    buf = np.full((max(1, est_rows), 1 + 33 * 3), np.nan, dtype=np.float32)
+    n_rows = 0
+    missed = []
+
+    # Decode on a background thread so frame reads overlap MediaPipe inference (which releases the GIL);
+    # rows are still written here, in frame order
+    q = queue.Queue(maxsize=4)
+    stop = threading.Event()
+    producer = threading.Thread(target=_producer, args=(cap, sample_stride, input_side, q, stop), daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            frame_idx, rgb_frame = q.get()
+            if rgb_frame is None:
+                break
+            results = pose.process(rgb_frame)
+
+            if n_rows == len(buf):
+                buf = np.concatenate([buf, np.full_like(buf, np.nan)])
+            buf[n_rows, 0] = frame_idx
+            if results.pose_landmarks:
+                buf[n_rows, 1:] = [c for lm in results.pose_landmarks.landmark for c in (lm.x, lm.y, lm.visibility)]
+            else:
+                # Row stays NaN if no detection
+                missed.append(frame_idx)
+            n_rows += 1
+
+            if n_rows % 50 == 0:
+                logger.info(f"Processed {n_rows} frames for pose...")
+    finally:
+        # Unblock the producer if inference stopped early, then release the capture
+        stop.set()
+        while producer.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                producer.join(timeout=0.1)
+        cap.release()
+        pose.close()
 
     # Prepare column names
     columns = ["frame"]
     for i in range(33):
         columns.extend([f"x_{i}", f"y_{i}", f"v_{i}"])
 
-    df = pd.DataFrame(all_keypoints, columns=columns)
-    KEYPOINTS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(KEYPOINTS_FILE, index=False)
+    df = pd.DataFrame(buf[:n_rows], columns=columns).astype({"frame": np.int32})
+    if sample_stride > 1:
+        # Fill skipped frames only between two detected samples: interpolation never extrapolates
+        # past the ends, and any skipped frame next to a missed sample stays NaN
+        df = (df.set_index("frame")
+                .reindex(range(frame_idx))
+                .interpolate("linear", limit_area="inside")
+                .rename_axis("frame")
+                .reset_index())
+        missed_mask = np.zeros(frame_idx)
+        missed_mask[missed] = 1
+        near_missed = np.convolve(missed_mask, np.ones(2 * sample_stride - 1), mode="same") > 0
+        df.loc[near_missed, columns[1:]] = np.nan
+    write_table(df, KEYPOINTS_FILE)
 
     logger.info(f"Pose keypoints saved to {KEYPOINTS_FILE}")
 
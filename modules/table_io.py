@@ -0,0 +1,36 @@
+import operator
+import pandas as pd
+from pathlib import Path
+from typing import List, Optional, Tuple, Any
+
+# Format for intermediate artifacts (pose keypoints, bat positions, metrics, phases): "parquet" or "csv"
+OUTPUT_FORMAT = "parquet"
+
+_OPS = {"==": operator.eq, "=": operator.eq, "!=": operator.ne,
+        "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+def read_table(path: Path, columns: Optional[List[str]] = None,
+               filters: Optional[List[Tuple[str, str, Any]]] = None) -> pd.DataFrame:
+    """
+    Read an intermediate table, dispatching on file suffix.
+    `filters` are pyarrow-style (column, op, value) tuples ANDed together; Parquet pushes
+    them down to the reader, CSV applies them after loading.
+    """
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path, columns=columns, filters=filters)
+
+    df = pd.read_csv(path, usecols=columns)
+    for col, op, val in filters or []:
+        mask = df[col].isin(val) if op == "in" else _OPS[op](df[col], val)
+        df = df[mask]
+    return df.reset_index(drop=True)
+
+def write_table(df: pd.DataFrame, path: Path):
+    """Write an intermediate table, dispatching on file suffix."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".parquet":
+        df.to_parquet(path, compression="snappy", index=False)
+    else:
+        df.to_csv(path, index=False)
@@ -1,4 +1,5 @@
 from pathlib import Path
+import functools
 import shutil
 import yt_dlp
 from modules.logger import get_logger
@@ -6,6 +7,7 @@ from modules.cache_manager import needs_update, update_cache
 
 logger = get_logger("video_downloader")
 
+@functools.lru_cache(maxsize=1)
 def ffmpeg_available() -> bool:
     """Check if ffmpeg is installed and available in PATH."""
     return shutil.which("ffmpeg") is not None
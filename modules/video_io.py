@@ -0,0 +1,59 @@
+import cv2
+import functools
+import shutil
+import subprocess
+from pathlib import Path
+from modules.logger import get_logger
+
+logger = get_logger("video_io")
+
+# Ask the FFmpeg backend for any available hardware decoder (VAAPI/NVDEC/VideoToolbox/...)
+HW_PARAMS = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY, cv2.CAP_PROP_HW_DEVICE, -1]
+# Single-threaded software encode, for callers running one encoder per process (NVENC caps concurrent sessions)
+X264_SINGLE_THREAD = ("-c:v", "libx264", "-preset", "ultrafast", "-threads", "1")
+
+def open_capture(video_path: Path) -> cv2.VideoCapture:
+    """Open a video for reading with hardware-accelerated decode, falling back to the default backend."""
+    cap = cv2.VideoCapture(str(video_path), cv2.CAP_FFMPEG, HW_PARAMS)
+    if cap.isOpened():
+        return cap
+    cap.release()
+    logger.warning(f"⚠ Hardware-accelerated decode unavailable for {video_path}, using default backend")
+    return cv2.VideoCapture(str(video_path))
+
+@functools.lru_cache(maxsize=1)
+def _h264_encoder_args() -> tuple:
+    """Pick NVENC if a probe encode succeeds on this host, otherwise multithreaded libx264."""
+    probe = ["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", "color=size=256x256:rate=1",
+             "-frames:v", "1", "-c:v", "h264_nvenc", "-f", "null", "-"]
+    if subprocess.run(probe, capture_output=True).returncode == 0:
+        return ("-c:v", "h264_nvenc", "-preset", "p1")
+    return ("-c:v", "libx264", "-preset", "ultrafast")
+
+class FFmpegWriter:
+    """cv2.VideoWriter-compatible sink that pipes raw BGR frames to an ffmpeg H.264 encoder."""
+
+    def __init__(self, out_path: Path, fps: float, size: tuple, encoder_args: tuple = None):
+        w, h = size
+        cmd = ["ffmpeg", "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{w}x{h}", "-r", str(fps), "-i", "-",
+               *(encoder_args or _h264_encoder_args()), "-pix_fmt", "yuv420p", str(out_path)]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.proc.stdin.write(frame.tobytes())
+
+    def release(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.proc.returncode}")
+
+def open_writer(out_path: Path, fps: float, size: tuple, encoder_args: tuple = None):
+    """
+    Open an H.264 video writer via ffmpeg (NVENC when available), falling back to OpenCV mp4v.
+    `encoder_args` overrides the probed ffmpeg encoder arguments.
+    """
+    if shutil.which("ffmpeg"):
+        return FFmpegWriter(out_path, fps, size, encoder_args)
+    logger.warning("⚠ ffmpeg not found — encoding with OpenCV mp4v")
+    return cv2.VideoWriter(str(out_path), cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
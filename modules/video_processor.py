@@ -1,10 +1,41 @@
 import cv2
+import shutil
+import subprocess
 from pathlib import Path
 from modules.logger import get_logger
 from modules.cache_manager import needs_update, update_cache
+from modules.video_io import open_capture, open_writer
 
 logger = get_logger("video_processor")
 
+def _normalize_cv2(video_path: Path, output_path: Path, target_fps: int, target_res: tuple):
+    """Frame-by-frame resize + re-encode (fallback when the ffmpeg filter pass is unavailable or fails)."""
+    cap = open_capture(video_path)
+    out = open_writer(output_path, target_fps, target_res)
+
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_resized = cv2.resize(frame, target_res)
+        out.write(frame_resized)
+
+    cap.release()
+    out.release()
+
+def _ffmpeg(args: list) -> bool:
+    """Run ffmpeg quietly; log and return False on failure."""
+    proc = subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *args], capture_output=True, text=True)
+    if proc.returncode != 0:
+        logger.warning(f"⚠ ffmpeg failed: {proc.stderr.strip()}")
+    return proc.returncode == 0
+
+def _normalize_ffmpeg(video_path: Path, output_path: Path, target_fps: int, target_res: tuple) -> bool:
+    """Scale + resample in a single native ffmpeg pass. Returns False if ffmpeg failed."""
+    w, h = target_res
+    return _ffmpeg(["-i", str(video_path), "-vf", f"scale={w}:{h},fps={target_fps}",
+                    "-c:v", "libx264", "-preset", "veryfast", "-an", str(output_path)])
+
 def run(video_path: Path, target_fps: int, target_res: tuple) -> Path:
     """
     Normalize video FPS and resolution.
@@ -23,19 +54,20 @@ def run(video_path: Path, target_fps: int, target_res: tuple) -> Path:
 
     logger.info(f"Normalizing video to {target_fps} FPS, resolution {target_res}")
 
-    cap = cv2.VideoCapture(str(video_path))
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(str(output_path), fourcc, target_fps, target_res)
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame_resized = cv2.resize(frame, target_res)
-        out.write(frame_resized)
-
+    cap = open_capture(video_path)
+    src_res = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    src_fps = cap.get(cv2.CAP_PROP_FPS)
     cap.release()
-    out.release()
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+
+    if src_res == tuple(target_res) and abs(src_fps - target_fps) < 0.5:
+        # Already normalized: don't decode what we don't use
+        logger.info("Source already matches target FPS/resolution — copying without re-encode")
+        # Remux into mp4 when possible; plain byte copy otherwise
+        if not (has_ffmpeg and _ffmpeg(["-i", str(video_path), "-c:v", "copy", "-an", str(output_path)])):
+            shutil.copyfile(video_path, output_path)
+    elif not has_ffmpeg or not _normalize_ffmpeg(video_path, output_path, target_fps, target_res):
+        _normalize_cv2(video_path, output_path, target_fps, target_res)
 
     logger.info(f"Normalized video saved at {output_path}")
     update_cache("video_processor", [output_path], step_config)